@@ -234,6 +234,9 @@ class TestSourceGeneratorNodeVisitor(object):
 
         # attribute
         'x.y',
+        'x.y.z',
+        'f(x).y.z',
+        '(x + y).z',
 
         # ellipsis
         'x[...]',
@@ -327,6 +330,7 @@ class TestSourceGeneratorNodeVisitor(object):
         roundtrip_testdata += [
             # with multiple
             'with x, y:' + EOL + INDENT + 'pass',
+            'with x as a, y as b, z:' + EOL + INDENT + 'pass',
             # yield from
             FUNC_DEF + EOL + INDENT + 'yield from x',
         ]
@@ -406,3 +410,16 @@ class TestSourceGeneratorNodeVisitor(object):
         node.body[1].lineno = 1
         visitors.to_source(node)
         assert node.body[1].lineno == 2
+
+    def test_dispatch_table_per_class(self):
+        """Check if a subclass overriding a visit method does not affect its base class."""
+
+        class UpperNameVisitor(visitors.SourceGeneratorNodeVisitor):
+            def visit_Name(self, node):
+                self.write(node.id.upper())
+
+        node = transformers.ParentChildNodeTransformer().visit(ast.parse('x = y'))
+        upper_generator = UpperNameVisitor(self.INDENT)
+        upper_generator.visit(node)
+        assert ''.join(upper_generator.result) == 'X = Y'
+        assert visitors.to_source(node) == 'x = y'
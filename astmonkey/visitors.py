@@ -6,17 +6,30 @@ import pydot
 
 from astmonkey import utils
 from astmonkey.transformers import ParentChildNodeTransformer
-from astmonkey.utils import CommaWriter, check_version
+from astmonkey.utils import check_version
 
 
 class GraphNodeVisitor(ast.NodeVisitor):
+    _missing_field = object()
+    # shared by every node and edge; pydot copies them, so they must not be modified in place
+    _DOT_NODE_KWARGS = {
+        'shape': 'box',
+        'fontname': 'Curier'
+    }
+    _DOT_EDGE_KWARGS = {
+        'fontname': 'Curier'
+    }
+
     def __init__(self):
         self.graph = pydot.Dot(graph_type='graph', **self._dot_graph_kwargs())
+        self._node_labels = {}
+        self._node_ids = {}
 
     def visit(self, node):
-        if len(node.parents) <= 1:
+        parents_count = len(node.parents)
+        if parents_count <= 1:
             self.graph.add_node(self._dot_node(node))
-        if len(node.parents) == 1:
+        if parents_count == 1:
             self.graph.add_edge(self._dot_edge(node))
         super(GraphNodeVisitor, self).visit(node)
 
@@ -24,16 +37,33 @@ class GraphNodeVisitor(ast.NodeVisitor):
         return {}
 
     def _dot_node(self, node):
-        return pydot.Node(str(node), label=self._dot_node_label(node), **self._dot_node_kwargs(node))
+        return pydot.Node(self._dot_node_id(node), label=self._dot_node_label(node), **self._dot_node_kwargs(node))
+
+    def _dot_node_id(self, node):
+        # a node's id is needed for the node itself and for the edges to its parent and children
+        try:
+            return self._node_ids[node]
+        except KeyError:
+            node_id = self._node_ids[node] = str(node)
+            return node_id
 
     def _dot_node_label(self, node):
+        # nodes with several parents are labelled once per parent, so keep the result
+        try:
+            return self._node_labels[node]
+        except KeyError:
+            pass
         fields_labels = []
-        for field, value in ast.iter_fields(node):
-            if not isinstance(value, list):
+        missing_field = self._missing_field
+        for field in node._fields:
+            value = getattr(node, field, missing_field)
+            if value is not missing_field and not isinstance(value, list):
                 value_label = self._dot_node_value_label(value)
                 if value_label:
                     fields_labels.append('{0}={1}'.format(field, value_label))
-        return 'ast.{0}({1})'.format(node.__class__.__name__, ', '.join(fields_labels))
+        label = 'ast.{0}({1})'.format(node.__class__.__name__, ', '.join(fields_labels))
+        self._node_labels[node] = label
+        return label
 
     def _dot_node_value_label(self, value):
         if not isinstance(value, ast.AST):
@@ -43,13 +73,10 @@ class GraphNodeVisitor(ast.NodeVisitor):
         return None
 
     def _dot_node_kwargs(self, node):
-        return {
-            'shape': 'box',
-            'fontname': 'Curier'
-        }
+        return self._DOT_NODE_KWARGS
 
     def _dot_edge(self, node):
-        return pydot.Edge(str(node.parent), str(node), label=self._dot_edge_label(node), **self._dot_edge_kwargs(node))
+        return pydot.Edge(self._dot_node_id(node.parent), self._dot_node_id(node), label=self._dot_edge_label(node), **self._dot_edge_kwargs(node))
 
     def _dot_edge_label(self, node):
         label = node.parent_field
@@ -58,9 +85,7 @@ class GraphNodeVisitor(ast.NodeVisitor):
         return label
 
     def _dot_edge_kwargs(self, node):
-        return {
-            'fontname': 'Curier'
-        }
+        return self._DOT_EDGE_KWARGS
 
 
 """
@@ -110,11 +135,14 @@ UNARYOP_SYMBOLS = {
     ast.USub: '-'
 }
 
+# the generator reads symbols straight off the operator nodes, so the tables
+# below are only walked once, here
 ALL_SYMBOLS = {}
-ALL_SYMBOLS.update(BOOLOP_SYMBOLS)
-ALL_SYMBOLS.update(BINOP_SYMBOLS)
-ALL_SYMBOLS.update(CMPOP_SYMBOLS)
-ALL_SYMBOLS.update(UNARYOP_SYMBOLS)
+for _symbols in (BOOLOP_SYMBOLS, BINOP_SYMBOLS, CMPOP_SYMBOLS, UNARYOP_SYMBOLS):
+    ALL_SYMBOLS.update(_symbols)
+    for _op_class, _symbol in _symbols.items():
+        _op_class._symbol = _symbol
+del _symbols, _op_class, _symbol
 
 
 def to_source(node, indent_with=' ' * 4):
@@ -186,16 +214,25 @@ class BaseSourceGeneratorNodeVisitor(ast.NodeVisitor):
 
     def __init__(self, indent_with):
         self.result = []
+        self._lines = 0
         self.indent_with = indent_with
         self.indentation = 0
+        self._indents = ['']
+        self._dispatch = self._get_dispatch_table()
+
+    @classmethod
+    def _get_dispatch_table(cls):
+        # one table per visitor class, filled lazily by `visit`
+        if '_dispatch_table' not in cls.__dict__:
+            cls._dispatch_table = {}
+        return cls._dispatch_table
 
     @classmethod
     def _is_node_args_valid(cls, node, arg_name):
         return hasattr(node, arg_name) and getattr(node, arg_name) is not None
 
     def _get_current_line_no(self):
-        lines = len("".join(self.result).split('\n')) if self.result else 0
-        return lines
+        return self._lines
 
     @classmethod
     def _get_actual_lineno(cls, node):
@@ -238,10 +275,16 @@ class BaseSourceGeneratorNodeVisitor(ast.NodeVisitor):
             self.write(post)
 
     def write(self, x):
+        if not self.result:
+            self._lines = 1
+        self._lines += x.count('\n')
         self.result.append(x)
 
     def correct_line_number(self, node, within_statement=True, use_line_continuation=True):
-        if not node or not self._is_node_args_valid(node, 'lineno'):
+        lineno = getattr(node, 'lineno', None)
+        # the actual line number of a node is never past its lineno, so
+        # nodes on or before the current line need no correction
+        if lineno is None or lineno <= self._lines:
             return
         if within_statement:
             indent = 1
@@ -256,20 +299,29 @@ class BaseSourceGeneratorNodeVisitor(ast.NodeVisitor):
 
     def add_line(self, within_statement, use_line_continuation):
         if within_statement and use_line_continuation:
-            self.result.append('\\')
+            self.write('\\')
         self.write_newline()
 
     def write_newline(self):
         if self.result:
             self.result.append('\n')
-        self.result.append(self.indent_with * self.indentation)
+            self._lines += 1
+        else:
+            self._lines = 1
+        indents = self._indents
+        while len(indents) <= self.indentation:
+            indents.append(indents[-1] + self.indent_with)
+        self.result.append(indents[self.indentation])
 
     def body(self, statements, indent=1):
         if statements:
-            with self.indent(indent):
-                for stmt in statements:
-                    self.correct_line_number(stmt, within_statement=False)
-                    self.visit(stmt)
+            correct_line_number = self.correct_line_number
+            visit = self.visit
+            self.indentation += indent
+            for stmt in statements:
+                correct_line_number(stmt, within_statement=False)
+                visit(stmt)
+            self.indentation -= indent
 
     def body_or_else(self, node):
         self.body(node.body)
@@ -292,19 +344,19 @@ class BaseSourceGeneratorNodeVisitor(ast.NodeVisitor):
         self.write('%s%s%s' % (s[0] * 2, s, s[0] * 2))
 
     def signature(self, node, add_space=False):
-        write_comma = CommaWriter(self.write, add_space_at_beginning=add_space)
+        separator = ' ' if add_space else ''
         padding = [None] * (len(node.args) - len(node.defaults))
 
         for arg, default in zip(node.args, padding + node.defaults):
-            self.signature_arg(arg, default, write_comma)
+            self.signature_arg(arg, default, separator)
+            separator = ', '
 
-        self.signature_spec_arg(node, 'vararg', write_comma, prefix='*')
-        self.signature_kwonlyargs(node, write_comma)
-        self.signature_spec_arg(node, 'kwarg', write_comma, prefix='**')
+        separator = self.signature_spec_arg(node, 'vararg', separator, prefix='*')
+        separator = self.signature_kwonlyargs(node, separator)
+        self.signature_spec_arg(node, 'kwarg', separator, prefix='**')
 
-    def signature_arg(self, arg, default, write_comma, prefix=''):
-        write_comma()
-        self.write(prefix)
+    def signature_arg(self, arg, default, separator, prefix=''):
+        self.write(separator + prefix)
         self.visit(arg)
 
         if self._is_node_args_valid(arg, 'annotation'):
@@ -317,34 +369,49 @@ class BaseSourceGeneratorNodeVisitor(ast.NodeVisitor):
             self.write('=')
             self.visit(default)
 
-    def signature_kwonlyargs(self, node, write_comma):
+    def signature_kwonlyargs(self, node, separator):
         if not self._is_node_args_valid(node, 'kwonlyargs') or len(node.kwonlyargs) == 0:
-            return
+            return separator
 
         if not node.vararg:
-            write_comma()
-            self.write('*')
+            self.write(separator + '*')
+            separator = ', '
 
         for arg, default in zip(node.kwonlyargs, node.kw_defaults):
-            self.signature_arg(arg, default, write_comma)
+            self.signature_arg(arg, default, separator)
+            separator = ', '
+        return separator
 
-    def signature_spec_arg(self, node, var, write_comma, prefix):
+    def signature_spec_arg(self, node, var, separator, prefix):
         arg = getattr(node, var)
-        if arg:
-            if hasattr(node, var + 'annotation'):
-                arg = ast.arg(arg, getattr(node, var + 'annotation'))
-            self.signature_arg(arg, None, write_comma, prefix)
+        if not arg:
+            return separator
+        if hasattr(node, var + 'annotation'):
+            arg = ast.arg(arg, getattr(node, var + 'annotation'))
+        self.signature_arg(arg, None, separator, prefix)
+        return ', '
 
     def decorators(self, node):
         if node.decorator_list:
+            write = self.write
+            visit = self.visit
             for decorator in node.decorator_list:
-                self.write('@')
-                self.visit(decorator)
+                write('@')
+                visit(decorator)
             self.write_newline()
 
     def visit(self, node):
-        self.correct_line_number(node)
-        return super(BaseSourceGeneratorNodeVisitor, self).visit(node)
+        # same early exit as correct_line_number, without the extra call per node
+        lineno = getattr(node, 'lineno', None)
+        if lineno is not None and lineno > self._lines:
+            self.correct_line_number(node)
+        node_class = node.__class__
+        try:
+            visitor = self._dispatch[node_class]
+        except KeyError:
+            visitor = getattr(self.__class__, 'visit_' + node_class.__name__, self.__class__.generic_visit)
+            self._dispatch[node_class] = visitor
+        return visitor(self, node)
 
     # Statements
 
@@ -363,7 +430,7 @@ class BaseSourceGeneratorNodeVisitor(ast.NodeVisitor):
     def visit_AugAssign(self, node):
 
         self.visit(node.target)
-        self.write(' ' + BINOP_SYMBOLS[type(node.op)] + '= ')
+        self.write(' ' + node.op._symbol + '= ')
         self.visit(node.value)
 
     def visit_ImportFrom(self, node):
@@ -377,10 +444,10 @@ class BaseSourceGeneratorNodeVisitor(ast.NodeVisitor):
         self.write('from {0}{1} import {2}'.format('.' * node.level, node.module or '', ', '.join(imports)))
 
     def visit_Import(self, node):
-        write_comma = CommaWriter(self.write)
         self.write('import ')
-        for item in node.names:
-            write_comma()
+        for idx, item in enumerate(node.names):
+            if idx:
+                self.write(', ')
             self.visit(item)
 
     def visit_Expr(self, node):
@@ -410,25 +477,17 @@ class BaseSourceGeneratorNodeVisitor(ast.NodeVisitor):
         self.body(node.body)
 
     def _prefixes(self, prefixes):
-        self.write(' '.join(prefixes))
         if prefixes:
-            self.write(' ')
+            self.write(' '.join(prefixes) + ' ')
 
     def visit_ClassDef(self, node):
-        have_args = []
-
-        def paren_or_comma():
-            if have_args:
-                self.write(', ')
-            else:
-                have_args.append(True)
-                self.write('(')
-
+        have_args = False
         self.decorators(node)
 
         self.write('class %s' % node.name)
         for base in node.bases:
-            paren_or_comma()
+            self.write(have_args and ', ' or '(')
+            have_args = True
             self.visit(base)
         self.write(have_args and '):' or ':')
         self.body(node.body)
@@ -493,10 +552,10 @@ class BaseSourceGeneratorNodeVisitor(ast.NodeVisitor):
 
     def visit_Delete(self, node):
         self.write('del ')
-        for target in node.targets:
-            self.visit(target)
-            if target is not node.targets[-1]:
+        for idx, target in enumerate(node.targets):
+            if idx:
                 self.write(', ')
+            self.visit(target)
 
     def visit_Global(self, node):
         self.write('global ' + ', '.join(node.names))
@@ -506,10 +565,11 @@ class BaseSourceGeneratorNodeVisitor(ast.NodeVisitor):
 
     def visit_Return(self, node):
 
-        self.write('return')
         if node.value:
-            self.write(' ')
+            self.write('return ')
             self.visit(node.value)
+        else:
+            self.write('return')
 
     def visit_Break(self, node):
         self.write('break')
@@ -545,8 +605,15 @@ class BaseSourceGeneratorNodeVisitor(ast.NodeVisitor):
     # Expressions
 
     def visit_Attribute(self, node):
-        self.visit(node.value)
-        self.write('.' + node.attr)
+        # a.b.c is written in one go instead of recursing once per attribute
+        attrs = []
+        while isinstance(node, ast.Attribute):
+            attrs.append(node.attr)
+            node = node.value
+        self.visit(node)
+        attrs.append('')
+        attrs.reverse()
+        self.write('.'.join(attrs))
 
     def visit_Call(self, node):
         self.visit(node.func)
@@ -564,17 +631,20 @@ class BaseSourceGeneratorNodeVisitor(ast.NodeVisitor):
             self.call_signature(node.args, node.keywords, starargs, kwargs)
 
     def call_signature(self, args, keywords, starargs, kwargs):
-        write_comma = CommaWriter(self.write)
-        self.call_signature_part(args, self.call_arg, write_comma)
-        self.call_signature_part(keywords, self.call_keyword, write_comma)
-        self.call_signature_part(starargs, self.call_starargs, write_comma)
-        self.call_signature_part(kwargs, self.call_kwarg, write_comma)
+        first = self.call_signature_part(args, self.call_arg, True)
+        first = self.call_signature_part(keywords, self.call_keyword, first)
+        first = self.call_signature_part(starargs, self.call_starargs, first)
+        self.call_signature_part(kwargs, self.call_kwarg, first)
 
-    def call_signature_part(self, args, arg_processor, write_comma):
+    def call_signature_part(self, args, arg_processor, first):
         for arg in args:
-            write_comma()
+            if first:
+                first = False
+            else:
+                self.write(', ')
             self.correct_line_number(arg, use_line_continuation=False)
             arg_processor(arg)
+        return first
 
     def call_kwarg(self, kwarg):
         self.write('**')
@@ -605,7 +675,9 @@ class BaseSourceGeneratorNodeVisitor(ast.NodeVisitor):
     def visit_Num(self, node):
         value = node.n.imag if isinstance(node.n, complex) else node.n
 
-        with self.inside('(', ')', cond=(value < 0)):
+        if value < 0:
+            self.write('(%r)' % (node.n,))
+        else:
             self.write(repr(node.n))
 
     def visit_Tuple(self, node):
@@ -620,11 +692,16 @@ class BaseSourceGeneratorNodeVisitor(ast.NodeVisitor):
 
     def sequence_visit(left, right):  # @NoSelf
         def visit(self, node):
+            write = self.write
+            visit_item = self.visit
             with self.inside(left, right):
-                for idx, item in enumerate(node.elts):
-                    if idx:
-                        self.write(', ')
-                    self.visit(item)
+                items = iter(node.elts)
+                for item in items:
+                    visit_item(item)
+                    break
+                for item in items:
+                    write(', ')
+                    visit_item(item)
 
         return visit
 
@@ -647,29 +724,28 @@ class BaseSourceGeneratorNodeVisitor(ast.NodeVisitor):
     def visit_BinOp(self, node):
         with self.inside('(', ')', cond=isinstance(node.parent, (ast.BinOp, ast.Attribute))):
             self.visit(node.left)
-            self.write(' %s ' % BINOP_SYMBOLS[type(node.op)])
+            self.write(' %s ' % node.op._symbol)
             self.visit(node.right)
 
     def visit_BoolOp(self, node):
         with self.inside('(', ')'):
+            op = ' %s ' % node.op._symbol
             for idx, value in enumerate(node.values):
                 if idx:
-                    self.write(' %s ' % BOOLOP_SYMBOLS[type(node.op)])
+                    self.write(op)
                 self.visit(value)
 
     def visit_Compare(self, node):
         with self.inside('(', ')', cond=(isinstance(node.parent, ast.Compare))):
             self.visit(node.left)
             for op, right in zip(node.ops, node.comparators):
-                self.write(' %s ' % CMPOP_SYMBOLS[type(op)])
+                self.write(' %s ' % op._symbol)
                 self.visit(right)
 
     def visit_UnaryOp(self, node):
         with self.inside('(', ')', cond=isinstance(node.parent, (ast.BinOp, ast.UnaryOp))):
-            op = UNARYOP_SYMBOLS[type(node.op)]
-            self.write(op)
-            if op == 'not':
-                self.write(' ')
+            op = node.op._symbol
+            self.write(op == 'not' and 'not ' or op)
 
             with self.inside('(', ')', cond=(not isinstance(node.operand, (ast.Name, ast.Num))
                                              and not self._is_named_constant(node.operand))):
@@ -707,28 +783,30 @@ class BaseSourceGeneratorNodeVisitor(ast.NodeVisitor):
             self.visit(item)
 
     def visit_Yield(self, node):
-        self.write('yield')
         if node.value:
-            self.write(' ')
+            self.write('yield ')
             self.visit(node.value)
+        else:
+            self.write('yield')
 
     def visit_Lambda(self, node):
         with self.inside('(', ')', cond=isinstance(node.parent, ast.Call)):
             self.write('lambda')
             self.signature(node.args, add_space=True)
-            self.write(': ')
-            with self.inside('(', ')'):
-                self.visit(node.body)
+            self.write(': (')
+            self.visit(node.body)
+            self.write(')')
 
     def visit_Ellipsis(self, node):
         self.write('...')
 
     def generator_visit(left, right):  # @NoSelf
         def visit(self, node):
+            visit_item = self.visit
             self.write(left)
-            self.visit(node.elt)
+            visit_item(node.elt)
             for comprehension in node.generators:
-                self.visit(comprehension)
+                visit_item(comprehension)
             self.write(right)
 
         return visit
@@ -778,14 +856,15 @@ class BaseSourceGeneratorNodeVisitor(ast.NodeVisitor):
                 self.visit(if_)
 
     def visit_ExceptHandler(self, node):
-        self.write('except')
         if node.type is not None:
-            self.write(' ')
+            self.write('except ')
             self.visit(node.type)
             if node.name is not None:
                 self.write(' as ')
                 self.visit(node.name)
-        self.write(':')
+            self.write(':')
+        else:
+            self.write('except:')
         self.body(node.body)
 
     def visit_arg(self, node):
@@ -849,24 +928,18 @@ class SourceGeneratorNodeVisitorPython30(SourceGeneratorNodeVisitorPython27):
     __python_version__ = (3, 0)
 
     def visit_ClassDef(self, node):
-        have_args = []
-
-        def paren_or_comma():
-            if have_args:
-                self.write(', ')
-            else:
-                have_args.append(True)
-                self.write('(')
-
+        have_args = False
         self.decorators(node)
         self.correct_line_number(node)
         self.write('class %s' % node.name)
         for base in node.bases:
-            paren_or_comma()
+            self.write(have_args and ', ' or '(')
+            have_args = True
             self.visit(base)
         if self._is_node_args_valid(node, 'keywords'):
             for keyword in node.keywords:
-                paren_or_comma()
+                self.write(have_args and ', ' or '(')
+                have_args = True
                 self.visit(keyword)
         self.write(have_args and '):' or ':')
         self.body(node.body)
@@ -876,11 +949,12 @@ class SourceGeneratorNodeVisitorPython30(SourceGeneratorNodeVisitorPython27):
 
         self.write('def %s(' % node.name)
         self.signature(node.args)
-        self.write(')')
         if self._is_node_args_valid(node, 'returns'):
-            self.write(' -> ')
+            self.write(') -> ')
             self.visit(node.returns)
-        self.write(':')
+            self.write(':')
+        else:
+            self.write('):')
         self.body(node.body)
 
 
@@ -908,13 +982,13 @@ class SourceGeneratorNodeVisitorPython33(SourceGeneratorNodeVisitorPython32):
     def with_body(self, node, prefixes=[]):
         self._prefixes(prefixes)
         self.write('with ')
-        for with_item in node.items:
+        for idx, with_item in enumerate(node.items):
+            if idx:
+                self.write(', ')
             self.visit(with_item.context_expr)
             if with_item.optional_vars is not None:
                 self.write(' as ')
                 self.visit(with_item.optional_vars)
-            if with_item != node.items[-1]:
-                self.write(', ')
         self.write(':')
         self.body(node.body)
 
@@ -1030,25 +1104,25 @@ class SourceGeneratorNodeVisitorPython38(SourceGeneratorNodeVisitorPython36):
         self.visit(node.value)
 
     def signature(self, node, add_space=False):
-        write_comma = CommaWriter(self.write, add_space_at_beginning=add_space)
-
-
+        separator = ' ' if add_space else ''
         defaults = list(node.defaults)
 
         if node.posonlyargs:
             padding = [None] * (len(node.posonlyargs) - len(node.defaults))
             for arg, default in zip(node.posonlyargs, padding + defaults[:len(node.posonlyargs)]):
-                self.signature_arg(arg, default, write_comma)
+                self.signature_arg(arg, default, separator)
+                separator = ', '
             self.write(', /')
             defaults = defaults[len(node.posonlyargs):]
 
         padding = [None] * (len(node.args) - len(node.defaults))
         for arg, default in zip(node.args, padding + defaults):
-            self.signature_arg(arg, default, write_comma)
+            self.signature_arg(arg, default, separator)
+            separator = ', '
 
-        self.signature_spec_arg(node, 'vararg', write_comma, prefix='*')
-        self.signature_kwonlyargs(node, write_comma)
-        self.signature_spec_arg(node, 'kwarg', write_comma, prefix='**')
+        separator = self.signature_spec_arg(node, 'vararg', separator, prefix='*')
+        separator = self.signature_kwonlyargs(node, separator)
+        self.signature_spec_arg(node, 'kwarg', separator, prefix='**')
 
     @classmethod
     def _get_actual_lineno(cls, node):